@@ -2,16 +2,49 @@
 #   (http://www.forgeflow.com)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+from collections import defaultdict
 from datetime import datetime, timedelta
 
-from odoo import _, api, fields, models
+from odoo import _, _lt, api, fields, models
 from odoo.exceptions import UserError, ValidationError
+from odoo.osv import expression
+
+_RULE_DESCRIPTIONS = {
+    "periodic": _lt(
+        "Ensures that at least a defined number "
+        "of counts in a given period will "
+        "be run."
+    ),
+    "turnover": _lt(
+        "Schedules a count every time the total "
+        "turnover of a location exceeds the "
+        "threshold. This considers every "
+        "product going into/out of the location"
+    ),
+    "accuracy": _lt(
+        "Schedules a count every time the "
+        "accuracy of a location goes under a "
+        "given threshold."
+    ),
+    "zero": _lt(
+        "Perform an Inventory Adjustment every "
+        "time a location in the warehouse runs "
+        "out of stock in order to confirm it is "
+        "truly empty."
+    ),
+}
 
 
 class StockCycleCountRule(models.Model):
     _name = "stock.cycle.count.rule"
     _description = "Stock Cycle Counts Rules"
 
+    _RULE_DISPATCH = {
+        "periodic": "_compute_rule_periodic",
+        "turnover": "_compute_rule_turnover",
+        "accuracy": "_compute_rule_accuracy",
+    }
+
     name = fields.Char(required=True)
     rule_type = fields.Selection(
         selection="_selection_rule_types", string="Type of rule", required=True
@@ -54,8 +87,7 @@ class StockCycleCountRule(models.Model):
     )
 
     def _compute_currency_id(self):
-        for rec in self:
-            rec.currency_id = self.env.user.company_id.currency_id
+        self.currency_id = self.env.user.company_id.currency_id
 
     @api.model
     def _selection_rule_types(self):
@@ -68,59 +100,42 @@ class StockCycleCountRule(models.Model):
 
     @api.constrains("rule_type", "warehouse_ids")
     def _check_zero_rule(self):
-        for rec in self:
-            if rec.rule_type == "zero" and len(rec.warehouse_ids) > 1:
-                raise ValidationError(
-                    _(
-                        "Zero confirmation rules can only have one warehouse "
-                        "assigned."
-                    )
-                )
-            if rec.rule_type == "zero":
-                zero_rule = self.search(
-                    [
-                        ("rule_type", "=", "zero"),
-                        ("warehouse_ids", "=", rec.warehouse_ids.id),
-                    ]
-                )
-                if len(zero_rule) > 1:
-                    raise ValidationError(
-                        _(
-                            "You can only have one zero confirmation rule per "
-                            "warehouse."
-                        )
-                    )
-
-    @api.depends("rule_type")
-    def _compute_rule_description(self):
-        if self.rule_type == "periodic":
-            self.rule_description = _(
-                "Ensures that at least a defined number "
-                "of counts in a given period will "
-                "be run."
+        zero_recs = self.filtered(lambda r: r.rule_type == "zero")
+        if not zero_recs:
+            return
+        if any(len(rec.warehouse_ids) > 1 for rec in zero_recs):
+            raise ValidationError(
+                _("Zero confirmation rules can only have one warehouse assigned.")
             )
-        elif self.rule_type == "turnover":
-            self.rule_description = _(
-                "Schedules a count every time the total "
-                "turnover of a location exceeds the "
-                "threshold. This considers every "
-                "product going into/out of the location"
+        warehouse_domain = [("warehouse_ids", "in", zero_recs.warehouse_ids.ids)]
+        if any(not rec.warehouse_ids for rec in zero_recs):
+            warehouse_domain = expression.OR(
+                [warehouse_domain, [("warehouse_ids", "=", False)]]
             )
-        elif self.rule_type == "accuracy":
-            self.rule_description = _(
-                "Schedules a count every time the "
-                "accuracy of a location goes under a "
-                "given threshold."
+        groups = self.read_group(
+            expression.AND([[("rule_type", "=", "zero")], warehouse_domain]),
+            ["warehouse_ids"],
+            ["warehouse_ids"],
+        )
+        rule_count_by_warehouse = {}
+        for group in groups:
+            warehouse_id = group["warehouse_ids"] and group["warehouse_ids"][0]
+            rule_count_by_warehouse[warehouse_id] = group["warehouse_ids_count"]
+        if any(
+            rule_count_by_warehouse.get(rec.warehouse_ids.id, 0) > 1
+            for rec in zero_recs
+        ):
+            raise ValidationError(
+                _("You can only have one zero confirmation rule per warehouse.")
             )
-        elif self.rule_type == "zero":
-            self.rule_description = _(
-                "Perform an Inventory Adjustment every "
-                "time a location in the warehouse runs "
-                "out of stock in order to confirm it is "
-                "truly empty."
+
+    @api.depends("rule_type")
+    def _compute_rule_description(self):
+        for rec in self:
+            description = _RULE_DESCRIPTIONS.get(rec.rule_type)
+            rec.rule_description = (
+                str(description) if description else _("(No description provided.)")
             )
-        else:
-            self.rule_description = _("(No description provided.)")
 
     @api.constrains("periodic_qty_per_period", "periodic_count_period")
     def _check_negative_periodic(self):
@@ -138,21 +153,13 @@ class StockCycleCountRule(models.Model):
     @api.depends("location_ids")
     def _compute_warehouse_ids(self):
         for record in self:
-            wh_ids = []
-            for loc in record.location_ids:
-                if loc.warehouse_id:  # Make sure warehouse_id is set
-                    wh_ids.append(loc.warehouse_id.id)
-            wh_ids = list(set(wh_ids))  # Remove duplicates
-            record.warehouse_ids = [(6, 0, wh_ids)]
+            record.warehouse_ids = record.location_ids.warehouse_id
 
     def compute_rule(self, locs):
-        if self.rule_type == "periodic":
-            proposed_cycle_counts = self._compute_rule_periodic(locs)
-        elif self.rule_type == "turnover":
-            proposed_cycle_counts = self._compute_rule_turnover(locs)
-        elif self.rule_type == "accuracy":
-            proposed_cycle_counts = self._compute_rule_accuracy(locs)
-        return proposed_cycle_counts
+        handler = self._RULE_DISPATCH.get(self.rule_type)
+        if not handler or not locs:
+            return []
+        return getattr(self, handler)(locs)
 
     @api.model
     def _propose_cycle_count(self, date, location):
@@ -163,54 +170,78 @@ class StockCycleCountRule(models.Model):
         }
         return cycle_count
 
+    @api.model
+    def _get_latest_inventory_date_by_location(self, locs):
+        """Return a ``{location_id: date}`` dict with the date of the latest
+        inventory found for each of the given locations."""
+        groups = self.env["stock.inventory"].read_group(
+            [
+                ("location_ids", "in", locs.ids),
+                ("state", "in", ["draft", "in_progress", "done"]),
+            ],
+            ["location_ids", "date:max"],
+            ["location_ids"],
+        )
+        location_ids = set(locs.ids)
+        return {
+            group["location_ids"][0]: group["date"]
+            for group in groups
+            if group["location_ids"] and group["location_ids"][0] in location_ids
+        }
+
     @api.model
     def _compute_rule_periodic(self, locs):
+        if not locs:
+            return []
         cycle_counts = []
-        for loc in locs:
-            latest_inventory_date = (
-                self.env["stock.inventory"]
-                .search(
-                    [
-                        ("location_ids", "in", [loc.id]),
-                        ("state", "in", ["confirm", "done", "draft"]),
-                    ],
-                    order="date desc",
-                    limit=1,
+        latest_inventory_date_by_location = (
+            self._get_latest_inventory_date_by_location(locs)
+        )
+        today = datetime.today()
+        try:
+            period = self.periodic_count_period / self.periodic_qty_per_period
+            delta = timedelta(days=period)
+        except (AttributeError, ZeroDivisionError) as e:
+            raise UserError(
+                _(
+                    "Error found determining the frequency of periodic "
+                    "cycle count rule. %s"
                 )
-                .date
-            )
+                % str(e)
+            ) from e
+        for loc in locs:
+            latest_inventory_date = latest_inventory_date_by_location.get(loc.id)
             if latest_inventory_date:
-                try:
-                    period = self.periodic_count_period / self.periodic_qty_per_period
-                    next_date = fields.Datetime.from_string(
-                        latest_inventory_date
-                    ) + timedelta(days=period)
-                    if next_date < datetime.today():
-                        next_date = datetime.today()
-                except AttributeError as e:
-                    raise UserError(
-                        _(
-                            "Error found determining the frequency of periodic "
-                            "cycle count rule. %s"
-                        )
-                        % str(e)
-                    ) from e
+                next_date = latest_inventory_date + delta
+                if next_date < today:
+                    next_date = today
             else:
-                next_date = datetime.today()
+                next_date = today
             cycle_count = self._propose_cycle_count(next_date, loc)
             cycle_counts.append(cycle_count)
         return cycle_counts
 
     @api.model
-    def _get_turnover_moves(self, location, date):
+    def _get_locations_turnover_moves(self, date_by_location):
+        """Return the done moves in or out of the locations of the
+        ``{location_id: date}`` dict done after the date of that location."""
+        location_ids_by_date = defaultdict(list)
+        for location_id, date in date_by_location.items():
+            location_ids_by_date[date].append(location_id)
+        # Only filter on the location columns themselves: conditions on related
+        # location fields would be resolved through joins on stock_location.
+        date_domains = []
+        for date, location_ids in location_ids_by_date.items():
+            date_domains.append(
+                [
+                    ("date", ">", date),
+                    "|",
+                    ("location_id", "in", location_ids),
+                    ("location_dest_id", "in", location_ids),
+                ]
+            )
         moves = self.env["stock.move"].search(
-            [
-                "|",
-                ("location_id", "=", location.id),
-                ("location_dest_id", "=", location.id),
-                ("date", ">", date),
-                ("state", "=", "done"),
-            ]
+            expression.AND([[("state", "=", "done")], expression.OR(date_domains)])
         )
         return moves
 
@@ -222,31 +253,38 @@ class StockCycleCountRule(models.Model):
 
     @api.model
     def _compute_rule_turnover(self, locs):
+        if not locs:
+            return []
         cycle_counts = []
-        location_ids = locs.mapped("id")
-        inventories = self.env["stock.inventory"].search(
-            [
-                ("location_ids", "in", location_ids),
-                ("state", "in", ["confirm", "done", "draft"]),
-            ]
+        latest_inventory_date_by_location = (
+            self._get_latest_inventory_date_by_location(locs)
         )
-        inventory_dates_by_location = {loc.id: [] for loc in locs}
-        for inventory in inventories:
-            for location in inventory.location_ids:
-                if location.id in inventory_dates_by_location:
-                    inventory_dates_by_location[location.id].append(inventory.date)
+        today = datetime.today()
+        turnover_by_location = defaultdict(float)
+        if latest_inventory_date_by_location:
+            moves = self._get_locations_turnover_moves(
+                latest_inventory_date_by_location
+            )
+            # Prefetch the fallback cost used by move._get_price_unit().
+            moves.product_id.mapped("standard_price")
+            for move in moves:
+                turnover = None
+                for location_id in {move.location_id.id, move.location_dest_id.id}:
+                    latest_inventory = latest_inventory_date_by_location.get(
+                        location_id
+                    )
+                    if latest_inventory and move.date > latest_inventory:
+                        if turnover is None:
+                            turnover = self._compute_turnover(move)
+                        turnover_by_location[location_id] += turnover
 
         for loc in locs:
-            last_inventories = inventory_dates_by_location.get(loc.id, [])
-            if last_inventories:
-                latest_inventory = sorted(last_inventories, reverse=True)[0]
-                moves = self._get_turnover_moves(loc, latest_inventory)
-                if moves:
-                    total_turnover = sum(self._compute_turnover(m) for m in moves)
+            if loc.id in latest_inventory_date_by_location:
+                if loc.id in turnover_by_location:
+                    total_turnover = turnover_by_location[loc.id]
                     try:
                         if total_turnover > self.turnover_inventory_value_threshold:
-                            next_date = datetime.today()
-                            cycle_count = self._propose_cycle_count(next_date, loc)
+                            cycle_count = self._propose_cycle_count(today, loc)
                             cycle_counts.append(cycle_count)
                     except AttributeError as e:
                         raise UserError(
@@ -257,17 +295,21 @@ class StockCycleCountRule(models.Model):
                             % str(e)
                         ) from e
             else:
-                next_date = datetime.today()
-                cycle_count = self._propose_cycle_count(next_date, loc)
+                cycle_count = self._propose_cycle_count(today, loc)
                 cycle_counts.append(cycle_count)
         return cycle_counts
 
     def _compute_rule_accuracy(self, locs):
         self.ensure_one()
-        cycle_counts = []
-        for loc in locs:
-            if loc.loc_accuracy < self.accuracy_threshold:
-                next_date = datetime.today()
-                cycle_count = self._propose_cycle_count(next_date, loc)
-                cycle_counts.append(cycle_count)
+        if not locs:
+            return []
+        today = datetime.today()
+        threshold = self.accuracy_threshold
+        # Compute the accuracy of all the locations at once.
+        locs.mapped("loc_accuracy")
+        cycle_counts = [
+            self._propose_cycle_count(today, loc)
+            for loc in locs
+            if loc.loc_accuracy < threshold
+        ]
         return cycle_counts
@@ -80,7 +80,7 @@ class StockLocation(models.Model):
                 zero_rule = warehouse_to_rules.get(wh.id)
                 if zero_rule:
                     quants = self.env["stock.quant"].search(
-                        rec._get_zero_confirmation_domain()
+                        rec._get_zero_confirmation_domain(), limit=1
                     )
                     if not quants:
                         rec.create_zero_confirmation_cycle_count()
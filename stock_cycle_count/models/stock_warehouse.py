@@ -120,9 +120,7 @@ class StockWarehouse(models.Model):
         domain = [("location_id", "=", location.id), ("state", "in", ["draft"])]
         existing_cycle_counts = self.env["stock.cycle.count"].search(domain)
         if existing_cycle_counts:
-            existing_earliest_date = sorted(
-                existing_cycle_counts.mapped("date_deadline")
-            )[0]
+            existing_earliest_date = min(existing_cycle_counts.mapped("date_deadline"))
             existing_earliest_date = fields.Date.from_string(existing_earliest_date)
             cycle_count_proposed_date = fields.Date.from_string(
                 cycle_count_proposed["date"]
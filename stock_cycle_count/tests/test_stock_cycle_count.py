@@ -136,6 +136,23 @@ class TestStockCycleCount(common.TransactionCase):
         )
         return rule
 
+    def _create_done_move(self, location, location_dest, qty, date):
+        move = self.stock_move_model.create(
+            {
+                "name": "Turnover move",
+                "product_id": self.product1.id,
+                "product_uom_qty": qty,
+                "product_uom": self.product1.uom_id.id,
+                "location_id": location.id,
+                "location_dest_id": location_dest.id,
+            }
+        )
+        move._action_confirm()
+        move.quantity_done = qty
+        move._action_done()
+        move.date = date
+        return move
+
     def test_cycle_count_planner(self):
         """Tests creation of cycle counts."""
         # Common rules:
@@ -258,12 +275,103 @@ class TestStockCycleCount(common.TransactionCase):
         for r in rules:
             r._compute_rule_description()
             self.assertTrue(r.rule_description, "No description provided")
+        all_rules = self.stock_cycle_count_rule_model.browse([r.id for r in rules])
+        all_rules.invalidate_recordset(["rule_description"])
+        all_rules._compute_rule_description()
+        self.assertEqual(
+            len(set(all_rules.mapped("rule_description"))),
+            len(rules),
+            "Rule descriptions not computed for every rule.",
+        )
         self.assertEqual(
             self.rule_accuracy.warehouse_ids.ids,
             self.big_wh.ids,
             "Rules defined for zones are not getting the right " "warehouse.",
         )
 
+    def test_compute_rule_zero(self):
+        """Tests that zero confirmation rules propose no cycle count when
+        computed, as they are triggered by the locations running out of stock."""
+        self.assertEqual(self.zero_rule.compute_rule(self.count_loc), [])
+
+    def test_rule_periodic_in_progress_inventory(self):
+        """Tests that an in progress inventory postpones the next periodic
+        count of its location."""
+        loc = self.stock_location_model.create(
+            {
+                "name": "Periodic location",
+                "usage": "internal",
+                "location_id": self.big_wh.view_location_id.id,
+            }
+        )
+        inventory_date = datetime.now().replace(microsecond=0) - timedelta(days=1)
+        inventory = self.inventory_model.create(
+            {
+                "name": "In progress inventory",
+                "location_ids": [(4, loc.id)],
+                "date": inventory_date,
+            }
+        )
+        inventory.action_state_to_in_progress()
+        self.assertEqual(inventory.state, "in_progress")
+        cycle_counts = self.rule_periodic._compute_rule_periodic(loc)
+        # 2 counts every 7 days.
+        self.assertEqual(
+            cycle_counts[0]["date"],
+            inventory_date + timedelta(days=3.5),
+            "In progress inventory not considered by the periodic rule.",
+        )
+
+    def test_rule_turnover_threshold(self):
+        """Tests that only the moves done after the latest inventory of each
+        location are considered to compute its turnover."""
+        self.product1.standard_price = 10.0
+        self.rule_turnover.turnover_inventory_value_threshold = 60.0
+        loc_a = self.stock_location_model.create(
+            {
+                "name": "Turnover A",
+                "usage": "internal",
+                "location_id": self.big_wh.view_location_id.id,
+            }
+        )
+        loc_b = self.stock_location_model.create(
+            {
+                "name": "Turnover B",
+                "usage": "internal",
+                "location_id": self.big_wh.view_location_id.id,
+            }
+        )
+        now = datetime.now()
+        date_a = now - timedelta(days=10)
+        self.inventory_model.create(
+            {
+                "name": "Latest inventory A",
+                "location_ids": [(4, loc_a.id)],
+                "date": date_a,
+            }
+        )
+        self.inventory_model.create(
+            {
+                "name": "Latest inventory B",
+                "location_ids": [(4, loc_b.id)],
+                "date": now - timedelta(days=2),
+            }
+        )
+        # Before the inventory of A: 200 ignored for A.
+        self._create_done_move(self.count_loc, loc_a, 20.0, now - timedelta(days=20))
+        # After the inventory of A, before the one of B: 50 for A only.
+        self._create_done_move(loc_a, loc_b, 5.0, now - timedelta(days=5))
+        # After the inventory of B: 80 for B.
+        self._create_done_move(self.count_loc, loc_b, 8.0, now - timedelta(days=1))
+        cycle_counts = self.rule_turnover._compute_rule_turnover(loc_a | loc_b)
+        self.assertEqual(
+            [cycle_count["location"] for cycle_count in cycle_counts],
+            [loc_b],
+            "Turnover not computed from the latest inventory of each location.",
+        )
+        moves_a = self.rule_turnover._get_locations_turnover_moves({loc_a.id: date_a})
+        self.assertEqual(moves_a.mapped("product_uom_qty"), [5.0])
+
     def test_user_security(self):
         """Tests user rights."""
         with self.assertRaises(AccessError):
@@ -293,6 +401,27 @@ class TestStockCycleCount(common.TransactionCase):
         with self.assertRaises(ValidationError):
             self.zero_rule.warehouse_ids = [(4, self.small_wh.id)]
 
+    def test_rule_zero_constrains_batch(self):
+        """Tests the zero-confirmation uniqueness check on rules without
+        warehouse and on multi-record writes."""
+        self._create_stock_cycle_count_rule_zero(self.manager, "zero_rule_2")
+        with self.assertRaises(ValidationError):
+            self._create_stock_cycle_count_rule_zero(self.manager, "zero_rule_3")
+        other_wh = self.stock_warehouse_model.create({"name": "OTHER", "code": "O"})
+        rules = self.stock_cycle_count_rule_model.create(
+            [
+                {
+                    "name": "rule_%s" % wh.code,
+                    "rule_type": "periodic",
+                    "periodic_count_period": 7,
+                    "warehouse_ids": [(6, 0, wh.ids)],
+                }
+                for wh in self.small_wh | other_wh
+            ]
+        )
+        rules.write({"rule_type": "zero"})
+        self.assertEqual(rules.mapped("rule_type"), ["zero", "zero"])
+
     def test_auto_link_inventory_to_cycle_count_1(self):
         """Create an inventory that could fit a planned cycle count should
         auto-link it to that cycle count."""